@@ -9,10 +9,11 @@ import asyncio
 import getpass
 import os
 import websockets
-import json
+import orjson
 import logging
 import random
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 from src.utils._consts import get_num_future_goals, get_future_goals_priority, get_future_goals_range, get_num_max_present_goals
 import sys
 
@@ -31,6 +32,9 @@ from src.utils.logger import Logger, MAPPING_LEVEL
 from src.utils.exceptions import TimeLimitExceeded
 from consts import Tiles
 
+GOAL_SEARCH_EXPANSION_BUDGET = 2000
+MAX_PARTIAL_GOAL_SEARCHES = 10 # consecutive ticks without reaching the goal before ignoring it
+
 DIRECTION_TO_KEY = {
     "NORTH": "w",
     "WEST":  "a",
@@ -68,18 +72,28 @@ class Agent:
         
         ## Action controller
         self.ts = None
+        self.ts_ns = None # self.ts in the monotonic clock (time budget of the step)
         self.actions_plan = []
         self.action = None
         self.current_goals = []
         self.future_goals = []
         self.perfect_effects = False
         self.safe_action = None
+        self.out_queue = None # actions waiting to be sent to the server (see act and _writer)
+        self.writer_task = None
+        self.legal_actions = None # cached per tick (see _get_legal_actions)
+        self.learned_heuristics = {} # heuristic learned by the goal search (real-time search)
+        self.learned_heuristics_key = None
+        self.partial_goal_searches = 0 # consecutive goal searches that only found a partial plan
+        self.last_search_partial = False
         
     
     # ----- Main Loop -----
     
     async def close(self):
         """Close the websocket connection"""
+        if self.writer_task is not None:
+            self.writer_task.cancel()
         await self.websocket.close()
         # self.logger.info("Websocket connection closed")
     
@@ -91,13 +105,18 @@ class Agent:
     
     async def connect(self):
         """Connect to the server via websocket"""
-        self.websocket = await websockets.connect(f"ws://{self.server_address}/player")
-        await self.websocket.send(json.dumps({"cmd": "join", "name": self.agent_name}))
+        ## No compression and no message size limit: less work per message (one state per frame)
+        self.websocket = await websockets.connect(f"ws://{self.server_address}/player", max_size=None, compression=None)
+        await self.websocket.send(orjson.dumps({"cmd": "join", "name": self.agent_name}))
+        
+        ## Actions are sent by a single writer task, so act() never waits for the I/O
+        self.out_queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self._writer())
 
         # self.logger.info(f"Connected to server {self.server_address}")
         # self.logger.debug(f"Waiting for game information")
         
-        map_info = json.loads(await self.websocket.recv())
+        map_info = orjson.loads(await self.websocket.recv())
         
         self.fps = map_info["fps"]
         self.timeout = map_info["timeout"]
@@ -120,7 +139,11 @@ class Agent:
         
         try:
             while True:
-                state = json.loads(await self.websocket.recv())
+                ## Raise the writer error, if any (e.g. connection closed while sending)
+                if self.writer_task.done():
+                    self.writer_task.result()
+                
+                state = orjson.loads(await self.websocket.recv())
 
                 if not state.get("body"):
                     # self.logger.warning("Game Over!")
@@ -130,12 +153,13 @@ class Agent:
                 if state_ts > datetime.now(state_ts.tzinfo):
                     continue
                 
-                #self.logger.debug(f"Received state. Step: [{state["step"]}]")
+                # self.logger.debug("Received state. Step: [%s]", state["step"])
                 
                 ## --- Main Logic ---
+                ## Everything must fit in one frame (1/fps), including the websocket I/O (uvloop, if installed)
                 self.observe(state)
-                self.think(time_limit = ( self.ts + timedelta(seconds=1/(self.fps+0.6)) ))
-                await self.act()
+                self.think(deadline_ns = self.ts_ns + int(1e9/(self.fps+0.6)))
+                self.act() # sent by the writer task, overlapping with the next recv
                 ## ------------------
                 
                 # self.logger.mapping(f"Time elapsed: {(datetime.now() - self.ts).total_seconds()}")
@@ -147,41 +171,64 @@ class Agent:
     
     def observe(self, state):
         self.ts = datetime.fromisoformat(state["ts"])
+        ## Deadlines are checked with the monotonic clock (cheap int comparisons, no datetime objects)
+        self.ts_ns = time.monotonic_ns() - int((datetime.now(self.ts.tzinfo) - self.ts).total_seconds() * 1e9)
         self.perfect_effects = self.domain.is_perfect_effects(state)
+        self.legal_actions = None # invalidate the cached legal actions
         
         ## Update the mapping
         self.mapping.update(state, self.perfect_effects, self.current_goals + self.future_goals, self.actions_plan)
     
     # ------- Act --------
 
-    async def act(self):
-        """Send the action to the server"""
-        # self.logger.debug(f"Action: [{self.action}] in [{self.domain.actions(self.mapping.state)}]")
+    def act(self):
+        """Validate the action and queue it to be sent to the server"""
+        legal_actions = self._get_legal_actions()
+        # self.logger.debug("Action: [%s] in [%s]", self.action, legal_actions)
         
         if self._action_not_possible():
             # Big problem, because the agent is trying to do something that is not possible
             # Can happen if the sync between the agent and the server is not perfect
             # TODO: understand why this is happening. Maybe is masking some bigger problem
             # self.logger.critical(f"\33[31mAction not possible! [{self.action}]\33[0m")
-            self.action = self._get_fast_action(warning=True)
+            self.action = self._get_fast_action(legal_actions=legal_actions, warning=True)
         
-        await self.websocket.send(json.dumps({"cmd": "key", "key": DIRECTION_TO_KEY[self.action]})) # mapping to the server key
+        ## The action is final at this point, only the I/O is left to the writer task
+        self.out_queue.put_nowait(orjson.dumps({"cmd": "key", "key": DIRECTION_TO_KEY[self.action]})) # mapping to the server key
+    
+    async def _writer(self):
+        """Single consumer of the actions queue: sends the queued actions to the server"""
+        while True:
+            message = await self.out_queue.get()
+            
+            ## The server only keeps the last key received before each step,
+            ## so a burst of queued actions is sent as its most recent one
+            while not self.out_queue.empty():
+                message = self.out_queue.get_nowait()
+            
+            await self.websocket.send(message)
         
     def _action_not_possible(self):
-        return self.action not in self.domain.actions(self.mapping.state)
+        return self.action not in self._get_legal_actions()
+    
+    def _get_legal_actions(self):
+        """Legal actions for the current state, computed once per tick"""
+        if self.legal_actions is None:
+            self.legal_actions = self.domain.actions(self.mapping.state)
+        return self.legal_actions
     
     # ------ Think -------
     
-    def think(self, time_limit):
+    def think(self, deadline_ns):
         ## Follow the action plain (nothing new observed)            
         if len(self.actions_plan) != 0 and self.mapping.nothing_new_observed(self.current_goals):
             self.action = self.actions_plan.pop()
             
             ## Store a safe action for the next step
-            now = datetime.now()
-            half_time_limit = now + timedelta(seconds=(time_limit - now).total_seconds()/2)
+            now = time.monotonic_ns()
+            half_deadline_ns = now + (deadline_ns - now) // 2
             start_state = self.domain.result(self.mapping.state, self.action, self.current_goals)    
-            safe_point_2directions = self.find_safe_point_2directions(start_state, False, time_limit=half_time_limit)
+            safe_point_2directions = self.find_safe_point_2directions(start_state, False, deadline_ns=half_deadline_ns)
             # self.logger.mapping(f"[iteration] safe point time: {(datetime.now() - self.ts).total_seconds()}")
             self.safe_action = safe_point_2directions.pop() if safe_point_2directions else None
 
@@ -198,13 +245,13 @@ class Agent:
         self.action = None
                 
         ## Get directions to goal
-        goals_directions, force_traverse_disabled = self.find_directions_to_goals(time_limit)
+        goals_directions, force_traverse_disabled = self.find_directions_to_goals(deadline_ns)
         
         # self.logger.mapping(f"find goal time: {(datetime.now() - self.ts).total_seconds()}")
         
         ## Get direction to safe point
         start_state = self.mapping.state if not goals_directions else self.domain.result(self.mapping.state, goals_directions[-1], self.current_goals)    
-        safe_point_2directions = self.find_safe_point_2directions(start_state, force_traverse_disabled, time_limit)
+        safe_point_2directions = self.find_safe_point_2directions(start_state, force_traverse_disabled, deadline_ns)
         
         # self.logger.mapping(f"safe point time: {(datetime.now() - self.ts).total_seconds()}")
         
@@ -236,24 +283,42 @@ class Agent:
                 # self.logger.mapping("Safe action set! [no path found for both]")
                 return
             
-            self.action = self._get_fast_action(warning=True)
+            self.action = self._get_fast_action(legal_actions=self._get_legal_actions(), warning=True)
             
             # self.logger.mapping("No path found! [no safe point found]")
                 
         
-    def find_directions_to_goals(self, time_limit):
+    def find_directions_to_goals(self, deadline_ns):
         
         ## Get a new goal
         self.current_goals, force_traverse_disabled = self._find_goals() # Find a new goal
         # self.logger.mapping(f"Searching for: {[goal.position for goal in self.current_goals]}")
                 
-        problem = SearchProblem(self.domain, self.mapping.state, self.current_goals)
-        temp_tree = SearchTree(problem, strategy="A*")
-        
-        ## Search for the given goals
-        actions = temp_tree.search(
-            time_limit=min(datetime.now() + timedelta(seconds=self.current_goals[0].max_time), time_limit)
+        ## The learned heuristic is only valid for the same goals, observed objects and perfect effects
+        ## (the heuristic is scaled on super tiles depending on the perfect effects)
+        learned_heuristics_key = (self._goals_key(self.current_goals), self.mapping.objects_version, self.perfect_effects)
+        if learned_heuristics_key != self.learned_heuristics_key:
+            self.learned_heuristics = {}
+            self.learned_heuristics_key = learned_heuristics_key
+            self.partial_goal_searches = 0
+        
+        ## Search for the given goals (bounded lookahead: if not found, only the best first action is committed)
+        actions = self._search(
+            self.mapping.state,
+            self.current_goals,
+            deadline_ns=min(time.monotonic_ns() + int(self.current_goals[0].max_time * 1e9), deadline_ns),
+            expansion_budget=GOAL_SEARCH_EXPANSION_BUDGET,
+            heuristic_cache=self.learned_heuristics
         )
+        
+        ## Give up on a goal that the real-time search keeps failing to reach (e.g. behind walls)
+        if self.last_search_partial:
+            self.partial_goal_searches += 1
+            if self.partial_goal_searches > MAX_PARTIAL_GOAL_SEARCHES:
+                self.partial_goal_searches = 0
+                actions = None
+        else:
+            self.partial_goal_searches = 0
                 
         ## Ignore the goal if no path found
         if self._is_empty(actions):
@@ -263,40 +328,38 @@ class Agent:
         return actions, force_traverse_disabled
 
 
-    def find_safe_point_2directions(self, start_state, force_traverse_disabled, time_limit):
+    def find_safe_point_2directions(self, start_state, force_traverse_disabled, deadline_ns):
         
         ## Get a safe point
-        self.future_goals = self._find_future_goals(self.current_goals, force_traverse_disabled, time_limit)
+        self.future_goals = self._find_future_goals(self.current_goals, force_traverse_disabled, deadline_ns)
         
         # self.logger.mapping(f"Safe points {[point.position for point in self.future_goals]}")
-        # self.logger.mapping(f"Time allowed: {(time_limit - datetime.now()).total_seconds()}")
+        # self.logger.mapping(f"Time allowed: {(deadline_ns - time.monotonic_ns()) / 1e9}")
         ## Store a safe path to future goals
         safe_action = None
         while self._is_empty(safe_action) and len(self.future_goals) > 0:
             #print("remaining goals: ", len(self.future_goals))
             current_safe_point = self.future_goals[0]
 
-            ## Search structure
-            problem = SearchProblem(self.domain, start_state, [current_safe_point])
-            temp_tree = SearchTree(problem, strategy="A*")
-            
-            # self.logger.mapping(f"[@] Time allowed: {(time_limit - datetime.now()).total_seconds()}")
+            # self.logger.mapping(f"[@] Time allowed: {(deadline_ns - time.monotonic_ns()) / 1e9}")
             
             ## Search for the given goals
             #print("Max time: ", current_safe_point.max_time)
-            safe_action = temp_tree.search(
+            safe_action = self._search(
+                start_state,
+                [current_safe_point],
                 first_two_actions=True,
-                time_limit=min(datetime.now() + timedelta(seconds=current_safe_point.max_time), time_limit)
+                deadline_ns=min(time.monotonic_ns() + int(current_safe_point.max_time * 1e9), deadline_ns)
             )
 
             #print("safe_action: ", safe_action)
             
             if safe_action == -1:
-                current_time = datetime.now()
-                # self.logger.mapping(f"Time limit exceeded: {(current_time - time_limit).total_seconds()}s")
+                current_time = time.monotonic_ns()
+                # self.logger.mapping(f"Time limit exceeded: {(current_time - deadline_ns) / 1e9}s")
                                     
                 ## Check max execution time
-                if current_time > time_limit:
+                if current_time > deadline_ns:
                     self.mapping.ignore_goal(current_safe_point.position)
                     self.future_goals.pop(0)
                     break
@@ -311,15 +374,31 @@ class Agent:
         
         return safe_action
         
+    def _goals_key(self, goals):
+        return tuple((goal.goal_type, tuple(goal.position), goal.visited_range) for goal in goals)
+    
+    def _search(self, start_state, goals, deadline_ns, first_two_actions=False, expansion_budget=None, heuristic_cache=None):
+        """A* search from start_state to the goals"""
+        problem = SearchProblem(self.domain, start_state, goals, heuristic_cache=heuristic_cache)
+        tree = SearchTree(problem, strategy="A*")
+        plan = tree.search(deadline_ns=deadline_ns, first_two_actions=first_two_actions, expansion_budget=expansion_budget)
+        self.last_search_partial = tree.partial_solution
+        
+        ## Goal not reached: commit only to the first action towards the best frontier node (the search goes on next tick)
+        if tree.partial_solution:
+            return plan[-1:]
+        
+        return plan
+    
     def _is_empty(self, obj):
         return obj == -1 or obj is None or len(obj) == 0
     
-    def _find_future_goals(self, goals, force_traverse_disabled, time_limit):
-        start_t = datetime.now()
+    def _find_future_goals(self, goals, force_traverse_disabled, deadline_ns):
+        # start_t = time.monotonic_ns()
         safe_points = self.mapping.peek_next_exploration(force_traverse_disabled=force_traverse_disabled)
-        # self.logger.mapping(f"Time to peek_next_exploration: {(datetime.now() - start_t).total_seconds()}")
+        # self.logger.mapping(f"Time to peek_next_exploration: {(time.monotonic_ns() - start_t) / 1e9}")
 
-        total_time = (time_limit - datetime.now()).total_seconds()
+        total_time = (deadline_ns - time.monotonic_ns()) / 1e9
         num_safe_points = len(safe_points)
         decay_factor = 0.5  # Adjust this factor to control the rate of exponential decay
 
@@ -349,7 +428,7 @@ class Agent:
                     break
                 goals.append(Goal(
                     goal_type="super", 
-                    max_time=(self.ts + timedelta(seconds=allowed_time) - datetime.now()).total_seconds(),
+                    max_time=(self.ts_ns + int(allowed_time * 1e9) - time.monotonic_ns()) / 1e9,
                     visited_range=0,
                     priority=10, 
                     position=obj_position
@@ -363,7 +442,7 @@ class Agent:
                     break
                 goals.append(Goal(
                     goal_type="food", 
-                    max_time=(self.ts + timedelta(seconds=allowed_time) - datetime.now()).total_seconds(), 
+                    max_time=(self.ts_ns + int(allowed_time * 1e9) - time.monotonic_ns()) / 1e9, 
                     visited_range=0,
                     priority=10, 
                     position=obj_position
@@ -380,7 +459,7 @@ class Agent:
                 
             goals.append(Goal(
                 goal_type="exploration", 
-                max_time=(self.ts + timedelta(seconds=allowed_time) - datetime.now()).total_seconds(), 
+                max_time=(self.ts_ns + int(allowed_time * 1e9) - time.monotonic_ns()) / 1e9, 
                 visited_range=visited_range,
                 priority=10, 
                 position=exploration_pos
@@ -391,21 +470,24 @@ class Agent:
         
         return goals, force_traverse_disabled
 
-    def _get_fast_action(self, warning=True):
+    def _get_fast_action(self, legal_actions=None, warning=True):
         """Non blocking fast action"""
+        if legal_actions is None:
+            legal_actions = self._get_legal_actions()
+        
         # self.actions_plan = []
         
         # if warning:
         #     self.logger.mapping("Fast action!")
 
         # ## If there are no actions available, return None
-        if self.domain.actions(self.mapping.state) == []:
+        if legal_actions == []:
             # self.logger.warning("No actions available!") # you're dead ;(
             return random.choice(["NORTH", "WEST", "SOUTH", "EAST"])
 
         ## Use heuristics to choose the best action
         min_heuristic = None
-        for action in self.domain.actions(self.mapping.state):
+        for action in legal_actions:
             next_state = self.domain.result(self.mapping.state, action, self.current_goals)
             heuristic = self.domain.heuristic(next_state, self.current_goals) # change this!
             if min_heuristic is None or heuristic < min_heuristic:
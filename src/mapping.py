@@ -6,7 +6,6 @@ from collections import defaultdict
 from src.opponent_mapping import OpponentMapping
 from src.exploration_path import ExplorationPath
 from src.matrix_operations import MatrixOperations
-from src.goal import Goal
 from consts import Tiles
 from src.utils._consts import get_exploration_point_seen_threshold, get_duration_of_expire_cells, get_food_seen_threshold, get_near_goal_range
 
@@ -20,6 +19,7 @@ class Mapping:
         self.DEFAULT_IGNORED_GOAL_DURATION = (1 / self.fps)
 
         self.objects_updated = False
+        self.objects_version = 0 # incremented every time the observed objects are updated
         self.observed_objects = None
         self.observation_duration = 90
         self.opponent_duration = 5
@@ -230,6 +230,9 @@ class Mapping:
                     if not (obj_type == Tiles.SUPER and perfect_state):
                         self.objects_updated = True
 
+        if self.objects_updated:
+            self.objects_version += 1
+
         # if self.logger.mapping_active:
         #     self.print_mapping([goal.position for goal in goals], actions_plan)
         # self.logger.debug(f"New: {self.observed_objects}")
@@ -277,23 +280,22 @@ class Mapping:
         """Find the closest object based on the heuristic"""
         is_super_food_type = obj_type == Tiles.SUPER
         points = []         
-        min_heuristic = None
-        closest = None
         traverse = self.state["traverse"]
-        ## Get the closest food
+        body_cells = {(x << 8) | y for x, y in self.state["body"]} # packed cells: (x << 8) | y
+        ## Get the objects of this type
         for position in self.observed_objects.keys():
-            if self.is_ignored_goal(position) or self.observed_objects[position][0] != obj_type or list(position) in self.state["body"]:
+            if self.observed_objects[position][0] != obj_type or (position[0] << 8) | position[1] in body_cells or self.is_ignored_goal(position):
                 continue  # ignore the ignored goals, and the other objects
             
             points.append(position)
-            
-            heuristic = self.domain.heuristic(self.state, [Goal(goal_type=obj_type, position=position, visited_range=0)]) # change this!
-            if not min_heuristic or heuristic < min_heuristic:
-                min_heuristic = heuristic
-                closest = position
 
-        if not closest:
+        if not points:
             return []
+        
+        ## Get the closest one: for a single goal, the heuristic is the manhattan distance scaled by
+        ## factors that only depend on the head, so the distance alone gives the same order
+        head = self.state["body"][0]
+        closest = min(points, key=lambda position: self.domain.manhattan_distance(head, position, traverse))
 
         ## Get near goals
         near_objects = [closest]
@@ -308,7 +310,7 @@ class Mapping:
                     continue # not of this type
                 
                 if not traverse:
-                    if self._outside_of_domain(position) or position in self.domain.internal_walls:
+                    if self._outside_of_domain(position) or self.domain.is_wall(position):
                         continue
                     near_objects.append(position)
                     
@@ -7,37 +7,64 @@
  '''
 
 class SearchNode:
-    def __init__(self, state, parent, cost=0, heuristic=0, action=None): 
+    ## Allocated for every expansion: no per-instance __dict__
+    __slots__ = ('state', 'parent', 'depth', 'cost', 'heuristic', 'action', 'visited_cells', 'traverse', '_body', '_body_set', '_hash')
+    
+    def __init__(self, state, parent, cost=0, heuristic=0, action=None, visited_cells=0): 
         self.state = state
         self.parent = parent
-        self.depth = parent.depth + 1 if parent != None else 0
+        self.depth = parent.depth + 1 if parent is not None else 0
         self.cost = cost
         self.heuristic = heuristic
         self.action = action
+        self.visited_cells = visited_cells # bitset of the cells occupied along the path (see SearchTree)
+        
+        self.traverse = state["traverse"]
+        
+        ## Packed body, body set and hash: only built when needed (most nodes never reach the
+        ## full cycle check, see SearchTree), so a node only keeps its state in memory
+        self._body = None
+        self._body_set = None
+        self._hash = None
+    
+    @property
+    def body(self):
+        """Body cells packed into a single int: (x << 8) | y (maps up to 256x256)"""
+        if self._body is None:
+            self._body = tuple((p[0] << 8) | p[1] for p in self.state["body"])
+        return self._body
+    
+    @property
+    def body_set(self):
+        if self._body_set is None:
+            self._body_set = frozenset(self.body)
+        return self._body_set
 
     def __str__(self):
         return "no(" + str(self.state) + "," + str(self.parent) + ")"
     def __repr__(self):
         return str(self)
     def __hash__(self):
-        return hash(str(self.state))
-    # def __lt__(self, other):
-    #     ## A* search
-    #     # return (self.cost + self.heuristic) < (other.cost + other.heuristic)
-    #     ## Greedy search
-    #     return self.heuristic < other.heuristic
+        if self._hash is None:
+            self._hash = hash((self.body, self.traverse, len(self.state["visited_goals"])))
+        return self._hash
+    def __eq__(self, other):
+        ## Same snake with the same goals progress (the visited goals of a path only grow)
+        if not isinstance(other, SearchNode):
+            return NotImplemented
+        return (self.body == other.body and self.traverse == other.traverse
+                and len(self.state["visited_goals"]) == len(other.state["visited_goals"]))
     
     def in_parent(self, newstate):
+        ## Cycle: an ancestor with the same traverse and a body containing the new body
+        new_body = frozenset((p[0] << 8) | p[1] for p in newstate["body"])
+        traverse = newstate["traverse"]
         
-        if self.parent is None:
-            return False
+        ## Iterative walk over the ancestors (avoids deep recursion)
+        node = self.parent
+        while node is not None:
+            if node.traverse == traverse and new_body <= node.body_set:
+                return True
+            node = node.parent
         
-        if all(b in self.parent.state["body"] for b in newstate["body"]) and self.parent.state["traverse"] == newstate["traverse"]:
-            return True
-        
-        # if newstate["body"][0] in self.parent.state["body"] and self.parent.state["traverse"] == newstate["traverse"]:
-        #     return True
-        
-        return self.parent.in_parent(newstate)
-
-    
+        return False
@@ -10,11 +10,34 @@ from src.search.search_domain import SearchDomain
 class SearchProblem:
     """Search Problem"""
     
-    def __init__(self, domain: SearchDomain, initial, goals, num_present_goals=1):
+    def __init__(self, domain: SearchDomain, initial, goals, num_present_goals=1, heuristic_cache=None):
         self.domain = domain
         self.initial = initial
         self.goals = goals
         self.num_present_goals = num_present_goals
+        
+        ## Heuristic memo: (head_x, head_y, traverse, num_visited_goals) -> value
+        ## The goals are fixed for the problem, so a head cell is only evaluated once.
+        ## It can be shared between problems with the same goals, to keep the learned values (see update_heuristic)
+        self.heuristic_cache = heuristic_cache if heuristic_cache is not None else {}
+    
+    def _heuristic_key(self, state):
+        head = state["body"][0]
+        return (head[0], head[1], state["traverse"], len(state["visited_goals"]))
+    
+    def heuristic(self, state):
+        key = self._heuristic_key(state)
+        value = self.heuristic_cache.get(key)
+        if value is None:
+            value = self.domain.heuristic(state, self.goals)
+            self.heuristic_cache[key] = value
+        return value
+    
+    def update_heuristic(self, state, value):
+        """Raise the heuristic of a state (learning step of the real-time search)"""
+        key = self._heuristic_key(state)
+        if value > self.heuristic(state):
+            self.heuristic_cache[key] = value
     
     def goal_test(self, state):
         return all(self.domain.satisfies(state, goal) for goal in self.goals)
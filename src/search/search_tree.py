@@ -5,8 +5,10 @@
  #  - Guilherme Santos (gui.santos91@ua.pt)
  # @ Create Time: 2024-10-13
  '''
-import datetime
+import heapq
 import sys
+import time
+from itertools import count
 from operator import attrgetter
 
 from src.search.search_node import SearchNode
@@ -18,11 +20,43 @@ class SearchTree:
     
     def __init__(self, problem: SearchProblem, strategy="A*"):
         self.problem = problem
-        root = SearchNode(problem.initial, None, heuristic=problem.domain.heuristic(problem.initial, problem.goals))
-        self.open_nodes = [root]
+        root = SearchNode(
+            problem.initial, 
+            None, 
+            heuristic=problem.heuristic(problem.initial), 
+            visited_cells=self.cells_bitset(problem.initial["body"])
+        )
         self.best_solution = None
         self.non_terminals = 0
         self.strategy = strategy
+        
+        ## Priority of a node in the open nodes
+        if strategy == "A*":
+            self.priority_key = lambda node: node.cost + node.heuristic
+        elif strategy == "greedy":
+            self.priority_key = lambda node: node.heuristic
+        else:
+            sys.exit(f"Unknown strategy: {strategy}")
+        
+        ## Anytime search (see search with an expansion budget)
+        self.expanded_nodes = []
+        self.partial_solution = False
+        
+        ## Open nodes as a heap of (priority, insertion order, node): ties are solved in FIFO order,
+        ## so the nodes themselves are never compared
+        self.counter = count()
+        self.open_nodes = []
+        self.add_to_open([root])
+
+    # Bitset (int) with one bit per map cell: x * height + y
+    def cell_bit(self, position):
+        return 1 << (position[0] * self.problem.domain.height + position[1])
+    
+    def cells_bitset(self, cells):
+        bitset = 0
+        for position in cells:
+            bitset |= self.cell_bit(position)
+        return bitset
 
     # Get the root two actions to a given node
     def first_two_actions_to(self, node):
@@ -59,14 +93,29 @@ class SearchTree:
             n = n.parent         
         return self.inverse_plan(solution)
 
+    # Path from root to the most promising frontier node, learning the heuristic of the expanded nodes
+    # (learning step of RTAA*: h(n) = f(best) - g(n), a cheaper form of the LSS-LRTA* Dijkstra backup)
+    def partial_plan_to(self, node):
+        f_best = node.cost + node.heuristic
+        for expanded in self.expanded_nodes:
+            self.problem.update_heuristic(expanded.state, f_best - expanded.cost)
+        
+        self.partial_solution = True
+        return self.inverse_plan(node)
+
     # Search solution
-    def search(self, time_limit=None, first_two_actions=False):
+    # With an expansion budget, the search is anytime: when the budget (or the time) runs out,
+    # the path to the best frontier node is returned instead of failing (see partial_solution)
+    # The deadline is in the monotonic clock: time.monotonic_ns()
+    def search(self, deadline_ns=None, first_two_actions=False, expansion_budget=None):
         while self.open_nodes is not None and len(self.open_nodes) > 0:          
-            node = self.open_nodes.pop(0)
+            _, _, node = heapq.heappop(self.open_nodes)
 
-            if time_limit is not None and datetime.datetime.now() >= time_limit: 
+            if deadline_ns is not None and time.monotonic_ns() >= deadline_ns: 
                 ## Time limit exceeded
                 #print("time limit exceeded")
+                if expansion_budget is not None:
+                    return self.partial_plan_to(node)
                 return -1
 
             ## Goals test: all goals are satisfied
@@ -78,23 +127,34 @@ class SearchTree:
                 
                 return self.inverse_plan_to_solution(node)
 
+            ## Expansion budget exhausted
+            if expansion_budget is not None:
+                if self.non_terminals >= expansion_budget:
+                    return self.partial_plan_to(node)
+                self.expanded_nodes.append(node)
+
             self.non_terminals += 1
             new_lower_nodes = []
             visited_goal = None
             ## Iterate over possible actions to generate new nodes
             for act in self.problem.domain.actions(node.state):
                 
-                if time_limit is not None and datetime.datetime.now() >= time_limit: 
+                if deadline_ns is not None and time.monotonic_ns() >= deadline_ns: 
                     ## Time limit exceeded
+                    if expansion_budget is not None:
+                        return self.partial_plan_to(node)
                     return -1
 
                 new_state = self.problem.domain.result(node.state, act, self.problem.goals)
 
-                if node.in_parent(new_state):
+                ## An ancestor can only contain the new body if the new head was already occupied in this path
+                ## (bitset of the initial body + every head since), so the full check is only done on a hit
+                head_bit = self.cell_bit(new_state["body"][0])
+                if node.visited_cells & head_bit and node.in_parent(new_state):
                     continue
 
                 cost = node.cost + self.problem.domain.cost(node.state, act)
-                heuristic = self.problem.domain.heuristic(new_state, self.problem.goals)
+                heuristic = self.problem.heuristic(new_state)
                 # print("heuristic: ", heuristic)
                 new_node = SearchNode(
                     new_state, 
@@ -102,6 +162,7 @@ class SearchTree:
                     cost,
                     heuristic=heuristic,
                     action=act,
+                    visited_cells=node.visited_cells | head_bit
                     )
                 
                 new_lower_nodes.append(new_node)
@@ -111,15 +172,8 @@ class SearchTree:
     
     # add new nodes to the list of open nodes according to the strategy
     def add_to_open(self, new_lower_nodes):
-        self.open_nodes.extend(new_lower_nodes)
-        
-        if self.strategy == "A*":
-            self.open_nodes.sort(key=lambda node: node.cost + node.heuristic)
-            #print(self.open_nodes)
-        elif self.strategy == "greedy":
-            self.open_nodes.sort(key=lambda node: node.heuristic)
-        else:
-            sys.exit(f"Unknown strategy: {self.strategy}")        
+        for node in new_lower_nodes:
+            heapq.heappush(self.open_nodes, (self.priority_key(node), next(self.counter), node))
         
     def __str__(self):
         return f"SearchTree: {self.problem} {self.best_solution} {self.non_terminals} {self.open_nodes}"
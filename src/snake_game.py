@@ -22,24 +22,41 @@ SUPER_TILE_MULTIPLIER = 50
 DIRECT_COLLISION_PENALTY = 150
 ADJACENT_COLLISION_PENALTY = 100
 
+def next_head(head, vector, width, height):
+    """Head position after a move (the map wraps around)"""
+    return [(head[0] + vector[0]) % width, (head[1] + vector[1]) % height]
+
+def wrapped_distance(a, b, size):
+    """Distance between two coordinates on a wrapping axis"""
+    d = abs(a - b)
+    return min(d, size - d)
+
 class SnakeGame(SearchDomain):
     def __init__(self, logger, width, height, internal_walls, max_steps, opponent_head=None, opponent_direction=None):
         self.logger = logger
         self.width = width
         self.height = height
         self.internal_walls = internal_walls
+        
+        ## Walls bitmap: one byte per cell, indexed by x * height + y
+        self.walls = bytearray(width * height)
+        for x, y in internal_walls:
+            self.walls[x * height + y] = 1
+        
         self.max_steps = max_steps
         self.opponent_head = opponent_head
         self.opponent_direction = opponent_direction
     
+    def is_wall(self, position):
+        return self.walls[position[0] * self.height + position[1]] == 1
+    
     def is_perfect_effects(self, state):
         return is_snake_in_perfect_effects(state, self.max_steps)
     
     def _check_collision(self, state, action):
         """Check if the action will result in a collision"""
         body = state["body"]
-        vector = DIRECTIONS[action]
-        new_head = [(body[0][0] + vector[0]) % self.width, (body[0][1] + vector[1]) % self.height]
+        new_head = next_head(body[0], DIRECTIONS[action], self.width, self.height)
         
         if new_head in body:
             return True
@@ -56,18 +73,12 @@ class SnakeGame(SearchDomain):
             if new_head == opponent_head:
                 return True # collision with opponent head
 
-            possible_collisions = [
-                ((opponent_head[0] - 1) % self.width, opponent_head[1]),
-                ((opponent_head[0] + 1) % self.width, opponent_head[1]),
-                (opponent_head[0], (opponent_head[1] - 1) % self.height),
-                (opponent_head[0], (opponent_head[1] + 1) % self.height)
-            ]
-
-            if (new_head[0], new_head[1]) in possible_collisions:
+            ## Cells next to the opponent head (wrapping around the map)
+            if wrapped_distance(new_head[0], opponent_head[0], self.width) + wrapped_distance(new_head[1], opponent_head[1], self.height) == 1:
                 return True # POSSIBLE collision with opponent head
         
         if not state["traverse"]:
-            if new_head in self.internal_walls:
+            if self.is_wall(new_head):
                 return True
             
             head = body[0]
@@ -87,15 +98,14 @@ class SnakeGame(SearchDomain):
 
     def result(self, state, action, goals): # Given a state and an action, what is the next state?
         body = state["body"]
-        vector = DIRECTIONS[action]
-        new_head = [(body[0][0] + vector[0]) % self.width, (body[0][1] + vector[1]) % self.height]
+        new_head = next_head(body[0], DIRECTIONS[action], self.width, self.height)
         
         new_body = [new_head] + body[:-1]
 
         sight_range = state["range"]
                 
         traverse = state["traverse"]
-        visited_goals = state["visited_goals"].copy()
+        visited_goals = state["visited_goals"] # shared with the parent state until a goal is visited (copy-on-write)
         for goal in goals:
             if tuple(goal.position) not in visited_goals:
                 if self.is_goal_visited(new_head, goal, traverse):
@@ -105,12 +115,12 @@ class SnakeGame(SearchDomain):
                         traverse = False # worst case scenario
                     elif goal.goal_type == "food":
                         new_body.append(body[-1]) # grow the snake
-                    visited_goals.add(tuple(goal.position))
+                    visited_goals = visited_goals | {tuple(goal.position)}
                 else:
                     break # if one goal is not visited, we break the loop
 
         ## Increment opponent head
-        observed_objects = state["observed_objects"].copy()
+        observed_objects = state["observed_objects"] # shared with the parent state until the opponent moves (copy-on-write)
         new_opponent_head = state["opponent_head"]
         
         ## Add it in the first iteration
@@ -124,6 +134,7 @@ class SnakeGame(SearchDomain):
             opponent_vector = DIRECTIONS[self.opponent_direction]
             new_opponent_head = ((new_opponent_head[0] + opponent_vector[0]) % self.width, (new_opponent_head[1] + opponent_vector[1]) % self.height)
             
+            observed_objects = observed_objects.copy()
             observed_objects[new_opponent_head] = [Tiles.SNAKE, 5]
             
         return {
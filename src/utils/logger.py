@@ -19,23 +19,26 @@ class Logger:
         self.log.setLevel(logging.DEBUG)  # Set default logging level to DEBUG
         self.mapping_active = False
 
-    def error(self, errorMsg):
-        if not self.mapping_active: self.log.error(errorMsg)
+    # The messages accept %-style args, only formatted if the level is enabled:
+    # logger.debug("Action: [%s] in [%s]", action, actions)
 
-    def info(self, infoMsg):
-        if not self.mapping_active: self.log.info(infoMsg)
+    def error(self, errorMsg, *args):
+        if not self.mapping_active: self.log.error(errorMsg, *args)
 
-    def debug(self, debugMsg):
-        if not self.mapping_active: self.log.debug(debugMsg)      
+    def info(self, infoMsg, *args):
+        if not self.mapping_active: self.log.info(infoMsg, *args)
 
-    def warning(self, warningMsg):
-        if not self.mapping_active: self.log.warning(warningMsg)
+    def debug(self, debugMsg, *args):
+        if not self.mapping_active: self.log.debug(debugMsg, *args)      
 
-    def critical(self, criticalMsg):
-        self.log.critical(criticalMsg)
+    def warning(self, warningMsg, *args):
+        if not self.mapping_active: self.log.warning(warningMsg, *args)
 
-    def mapping(self, mappingMsg):
-        self.log.mapping(mappingMsg)
+    def critical(self, criticalMsg, *args):
+        self.log.critical(criticalMsg, *args)
+
+    def mapping(self, mappingMsg, *args):
+        self.log.mapping(mappingMsg, *args)
 
     def activate_mapping(self):
         self.log.setLevel(MAPPING_LEVEL)
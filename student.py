@@ -15,6 +15,13 @@ async def agent_loop(server_address="localhost:8000", agent_name="student"):
     agent = Agent(server_address, agent_name)
     await agent.run()
     
+## Faster event loop for asyncio/websockets (optional, not available on Windows)
+## Must be installed before the event loop below is created
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
     
 # DO NOT CHANGE THE LINES BELLOW
 # You can change the default values using the command line, example: